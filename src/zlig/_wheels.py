@@ -2,10 +2,16 @@
 
 from __future__ import annotations
 
+import concurrent.futures
 import contextlib
-import filecmp
-import importlib.resources
+import dataclasses
+import fnmatch
+import functools
+import hashlib
+import importlib.metadata
+import importlib.util
 import io
+import json
 import os
 import pathlib
 import shutil
@@ -15,13 +21,17 @@ import sysconfig
 import typing
 
 import flit_core.common
+import flit_core.config
 import flit_core.wheel
-import jinja2
-import packaging.tags
-import toml
 
 from ._version import __version__ as zlig_version
 
+# These are imported where used, so PEP 517 hooks that do not build a wheel
+# (e.g. prepare_metadata_for_build_wheel) do not pay for loading them.
+if typing.TYPE_CHECKING:
+    import jinja2
+    import packaging.tags
+
 # CPython puts the linkable library in "lib" on POSIX, but "libs" on Windows.
 LIBDIRNAMES = {"nt": "libs", "posix": "lib"}
 
@@ -29,6 +39,12 @@ LIBDIRNAMES = {"nt": "libs", "posix": "lib"}
 # on Mac and Linux when building an unversioned dynamic library).
 ZIG_LIB_NAME_TEMPLATES = {"nt": "{name}.dll", "posix": "lib{name}.so"}
 
+# Records the inputs of the last successful Zig build, to skip unneeded ones.
+ZIG_BUILD_STAMP = pathlib.Path("zig-out", "zlig.stamp")
+
+# Directories skipped when looking for undeclared build inputs.
+SKIPPED_INPUT_DIRNAMES = {"__pycache__", "zig-cache", "zig-out"}
+
 INTERPRETER_SHORT_NAMES = {
     "python": "py",
     "cpython": "cp",
@@ -52,26 +68,169 @@ def _get_config_var(name: str) -> str:
     return value
 
 
+def _get_zig_executable() -> str:
+    """Find the Zig compiler bundled in the ziglang package.
+
+    This is what ``python -m ziglang`` runs, but calling it directly saves
+    starting another Python interpreter.
+    """
+    spec = importlib.util.find_spec("ziglang")
+    if spec is None or spec.origin is None:
+        raise RuntimeError("Cannot find Zig; is ziglang installed?")
+    return os.path.join(os.path.dirname(spec.origin), "zig")
+
+
+def _get_user_cache_dir() -> str:
+    """Per-user cache directory, shared by all projects built with zlig.
+
+    This follows the XDG base directory spec, using ``$XDG_CACHE_HOME`` if set
+    and ``~/.cache`` otherwise.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "zlig")
+
+
+@functools.lru_cache(maxsize=None)
+def _get_build_zig_template() -> jinja2.Template:
+    """Load the build.zig template.
+
+    Compiled template code is kept in Jinja2's bytecode cache, so only the
+    first build on a machine pays for compiling the template.
+    """
+    import jinja2
+
+    loader = jinja2.PackageLoader(__package__, "")
+    cache_dir = os.path.join(_get_user_cache_dir(), "jinja2")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        env = jinja2.Environment(loader=loader, bytecode_cache=bytecode_cache)
+        return env.get_template("build.zig.jinja2")
+    except OSError:  # The cache is optional, e.g. in a read-only sandbox.
+        env = jinja2.Environment(loader=loader)
+        return env.get_template("build.zig.jinja2")
+
+
+def _normalize_path(path: typing.Union[str, os.PathLike]) -> str:
+    """Normalize a path for comparison without touching the file system.
+
+    This is much cheaper than ``Path.resolve()`` since symlinks are not
+    followed, which is fine since both sides are found by walking the project.
+    """
+    return os.path.normcase(os.path.abspath(path))
+
+
+_StatKey = typing.Tuple[int, int]
+
+
+def _get_stat_key(path: str) -> _StatKey:
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, 1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _ArtifactRecord(typing.NamedTuple):
+    """Content digest of an artifact, recorded when it was last copied.
+
+    The digest is valid for the compiled artifact and the copied target as
+    long as their respective stat results do not change.
+    """
+
+    compiled: _StatKey
+    target: _StatKey
+    digest: str
+
+    @classmethod
+    def load(cls, path: str) -> typing.Optional[_ArtifactRecord]:
+        try:
+            with open(path, "rb") as f:
+                data = json.load(f)
+            compiled_size, compiled_mtime = data["compiled"]
+            target_size, target_mtime = data["target"]
+            return cls(
+                (compiled_size, compiled_mtime),
+                (target_size, target_mtime),
+                data["digest"],
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self._asdict(), f)
+
+
+def _copy_artifact(compiled: str, target: str) -> None:
+    """Copy a compiled artifact unless target already has the same content.
+
+    The content digest recorded next to the compiled artifact tells whether
+    either file changed since the last copy, so an unchanged artifact is
+    detected without reading either file, and each file is hashed at most once
+    when one of them changes.
+    """
+    compiled_key = _get_stat_key(compiled)
+    try:
+        target_key: typing.Optional[_StatKey] = _get_stat_key(target)
+    except FileNotFoundError:
+        target_key = None
+
+    record_path = f"{compiled}.zlig.json"
+    record = _ArtifactRecord.load(record_path)
+    if record is not None and record.compiled == compiled_key:
+        digest = record.digest
+    else:
+        digest = _hash_file(compiled)
+
+    if target_key is None or target_key[0] != compiled_key[0]:
+        target_digest = None
+    elif record is not None and record.target == target_key:
+        target_digest = record.digest
+    else:
+        target_digest = _hash_file(target)
+
+    if target_digest != digest:
+        shutil.copyfile(compiled, target)
+        target_key = _get_stat_key(target)
+    assert target_key is not None
+    # Flit keeps the executable bit when adding files to the wheel. This is
+    # done even if the content is unchanged, since copyfile() keeps the mode of
+    # an existing target, which would make the wheel depend on earlier builds.
+    shutil.copymode(compiled, target)
+    new_record = _ArtifactRecord(compiled_key, target_key, digest)
+    if new_record != record:
+        new_record.save(record_path)
+
+
 class _VersionInfo(typing.Protocol):
     major: int
     minor: int
 
 
-class _Platform(typing.NamedTuple):
+@dataclasses.dataclass(frozen=True)
+class _Platform:
     os_name: str = os.name
     py_version: _VersionInfo = sys.version_info
 
-    @property
+    @functools.cached_property
     def includepy(self) -> pathlib.Path:
         """Include path to Python API."""
         return pathlib.Path(_get_config_var("INCLUDEPY"))
 
-    @property
+    @functools.cached_property
     def libpy(self) -> pathlib.Path:
         """Linker path to Python API."""
         return pathlib.Path(sys.base_exec_prefix, LIBDIRNAMES[self.os_name])
 
-    @property
+    @functools.cached_property
     def python_lib_name(self) -> str:
         """The Python lib to dynamically link to.
 
@@ -83,79 +242,189 @@ class _Platform(typing.NamedTuple):
             return ""
         return f"python{self.py_version.major}{self.py_version.minor}"
 
-    @property
+    @functools.cached_property
     def ext_suffix(self) -> str:
         """The suffix used for an extension module."""
         return _get_config_var("EXT_SUFFIX")
 
-    @property
+    @functools.cached_property
     def tag(self) -> packaging.tags.Tag:
+        import packaging.tags
+
         return next(packaging.tags.sys_tags())
 
-    @property
+    @functools.cached_property
+    def tag_str(self) -> str:
+        """The wheel tag, formatted for the wheel filename and WHEEL file."""
+        tag = self.tag
+        return f"{tag.interpreter}-{tag.abi}-{tag.platform}"
+
+    @functools.cached_property
     def zig_lib_name_template(self) -> str:
         """The format Zig names compiles unversioned dynamic libraries."""
         return ZIG_LIB_NAME_TEMPLATES[self.os_name]
 
 
-class _Extension(typing.NamedTuple):
+def _has_magic(pattern: str) -> bool:
+    return any(c in pattern for c in "*?[")
+
+
+def _scan_dir(directory: str) -> typing.List[os.DirEntry]:
+    try:
+        with os.scandir(directory or os.curdir) as it:
+            return sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return []
+
+
+def _iter_matching_parts(
+    directory: str,
+    parts: typing.Sequence[str],
+) -> typing.Iterator[str]:
+    part, rest = parts[0], parts[1:]
+    if part == "**":
+        # Zero directories, then recurse into each subdirectory. A trailing
+        # "**" matches all files below the directory.
+        yield from _iter_matching_parts(directory, rest or ["*"])
+        for entry in _scan_dir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_matching_parts(
+                    os.path.join(directory, entry.name), parts
+                )
+    elif not _has_magic(part):
+        path = os.path.join(directory, part)
+        if rest and os.path.isdir(path):
+            yield from _iter_matching_parts(path, rest)
+        elif not rest and os.path.isfile(path):
+            yield path
+    else:
+        for entry in _scan_dir(directory):
+            if not fnmatch.fnmatch(entry.name, part):
+                continue
+            path = os.path.join(directory, entry.name)
+            if rest and entry.is_dir():
+                yield from _iter_matching_parts(path, rest)
+            elif not rest and entry.is_file():
+                yield path
+
+
+def _iter_matching_files(pattern: str) -> typing.Iterator[str]:
+    """Find files matching a source pattern, relative to the current directory.
+
+    A pattern without wildcards is checked directly instead of scanning the
+    directory. Wildcard patterns are matched with ``os.scandir`` and
+    ``fnmatch`` on strings, which is much faster than ``Path.glob()``. As with
+    ``Path.glob()``, hidden files and directories are matched, and ``**``
+    matches any number of directories without following symlinks. A trailing
+    ``**`` matches all files below the directory.
+    """
+    if not _has_magic(pattern):
+        if os.path.isfile(pattern):
+            yield pattern
+        return
+    parts = [p for p in pattern.replace(os.sep, "/").split("/") if p]
+    # Multiple "**" can reach the same file through different directories.
+    yield from dict.fromkeys(_iter_matching_parts("", parts))
+
+
+def _is_skipped_dir(name: str) -> bool:
+    """Whether a directory never contains build inputs.
+
+    This covers build outputs and caches, and hidden directories such as VCS
+    metadata and virtual environments.
+    """
+    return name.startswith(".") or name in SKIPPED_INPUT_DIRNAMES
+
+
+def _get_input_directories(
+    candidates: typing.Iterable[str],
+    root: str,
+) -> typing.List[str]:
+    """Directories to scan for build inputs, given normalized candidates.
+
+    Only directories strictly below root are kept, so a source at the project
+    root does not cause the whole project to be scanned. A directory inside
+    another kept one is dropped since it is scanned as part of its parent.
+    """
+    kept: typing.List[str] = []
+    for directory in sorted(candidates):
+        if not directory.startswith(os.path.join(root, "")):
+            continue
+        if any(directory.startswith(os.path.join(k, "")) for k in kept):
+            continue
+        relative = os.path.relpath(directory, root)
+        if any(_is_skipped_dir(part) for part in relative.split(os.sep)):
+            continue
+        kept.append(directory)
+    return kept
+
+
+@dataclasses.dataclass(frozen=True)
+class _Extension:
     name: str
     patterns: typing.Sequence[str]
+    sources: typing.Tuple[str, ...]
 
-    @property
-    def modname(self) -> str:
-        """The bare (non-qualified) module name of this extension.
-
-        For example, if an extension's full name is ``foo.bar``, this would be
-        ``bar``.
-        """
-        return self.name.rsplit(".", 1)[-1]
-
-    @property
-    def directory_in_package(self) -> pathlib.Path:
-        """The directory that contains this extension's artifact.
-
-        For example, if an extension's full name is ``foo.bar.rex``, this would
-        be ``foo/bar``.
-        """
-        return pathlib.Path(*self.name.split(".")[:-1])
+    # The bare (non-qualified) module name of this extension. For example, if
+    # an extension's full name is ``foo.bar``, this would be ``bar``.
+    modname: str
 
-    @property
-    def varname(self) -> str:
-        """Generate a Zig-safe unique identifier to use in the script.
+    # The directory that contains this extension's artifact. For example, if
+    # an extension's full name is ``foo.bar.rex``, this would be ``foo/bar``.
+    directory_in_package: pathlib.Path
 
-        This is based on the extension's name, but adding a deterministic
-        suffix to keep names unique.
-        """
-        prefix = self.name.replace(".", "_")
-        suffix = self.name.count(".")
-        return f"{prefix}_{suffix}"
+    # A Zig-safe unique identifier to use in the script. This is based on the
+    # extension's name, but adding a deterministic suffix to keep names unique.
+    varname: str
 
-    def get_target_path(self, platform: _Platform) -> pathlib.Path:
+    def get_target_path(
+        self,
+        tag: packaging.tags.Tag,
+        ext_suffix: str,
+    ) -> str:
         """Where the extension should end up being placed."""
-        tag = platform.tag
         filename = (
             f"{self.modname}."
             f"{tag.interpreter}-"
             f"{tag.platform}"
-            f"{platform.ext_suffix}"
+            f"{ext_suffix}"
+        )
+        return os.path.join(*self.directory_in_package.parts, filename)
+
+    def get_artifact_path(self, lib_name_template: str) -> str:
+        """Where Zig puts the compiled artifact of this extension."""
+        return os.path.join(
+            "zig-out",
+            "lib",
+            *self.directory_in_package.parts,
+            lib_name_template.format(name=self.modname),
         )
-        return self.directory_in_package.joinpath(filename)
-
-    def iter_sources(self) -> typing.Iterator[pathlib.Path]:
-        for pattern in self.patterns:
-            yield from pathlib.Path.cwd().glob(pattern)
 
 
 def _load_extension(decl: dict, module: flit_core.common.Module) -> _Extension:
-    root, name = decl["name"].split(".", 1)
-    if root != module.name:
+    root, *parts = decl["name"].split(".")
+    if root != module.name or not parts:
         raise NotImplementedError(f"Extensions must be under '{module.name}.'")
-    return _Extension(name, decl["sources"])
+    patterns = decl["sources"]
+    sources = tuple(
+        _normalize_path(p)
+        for pattern in patterns
+        for p in _iter_matching_files(pattern)
+    )
+    return _Extension(
+        name=".".join(parts),
+        patterns=patterns,
+        sources=sources,
+        modname=parts[-1],
+        directory_in_package=pathlib.Path(*parts[:-1]),
+        varname=f"{'_'.join(parts)}_{len(parts) - 1}",
+    )
 
 
 class WheelBuilder(flit_core.wheel.WheelBuilder):
     _extensions: typing.Sequence[_Extension]
+    _extension_sources: typing.FrozenSet[str]
+    _wheel_relname: str
     _platform = _Platform()
 
     @classmethod
@@ -164,19 +433,36 @@ class WheelBuilder(flit_core.wheel.WheelBuilder):
         path: pathlib.Path,
         stream: typing.BinaryIO,
     ) -> WheelBuilder:
-        self = cls.from_ini_path(path, stream)
-        with path.open(encoding="utf-8") as f:
-            data = toml.load(f)
+        # Parse pyproject.toml once and share it with Flit, instead of going
+        # through from_ini_path(), which reads the file on its own.
+        if sys.version_info >= (3, 11):
+            import tomllib
+        else:
+            import tomli as tomllib
+
+        with path.open("rb") as f:
+            data = tomllib.load(f)
+        ini_info = flit_core.config.prep_toml_config(data, path)
+        module = flit_core.common.Module(ini_info.module, path.parent)
+        self = cls(
+            path.parent,
+            module,
+            flit_core.common.make_metadata(module, ini_info),
+            ini_info.entrypoints,
+            stream,
+            ini_info.data_directory,
+        )
         # TODO: Validation?
         self._extensions = [
             _load_extension(decl, self.module)
             for decl in data["tool"]["zlig"]["extensions"]
         ]
-        self._extension_sources = {
-            source.resolve()
-            for ext in self._extensions
-            for source in ext.iter_sources()
-        }
+        self._extension_sources = frozenset(
+            source for ext in self._extensions for source in ext.sources
+        )
+        # Flit computes dist_info on each access, and this is checked for
+        # every file written to the wheel.
+        self._wheel_relname = f"{self.dist_info}/WHEEL"
         return self
 
     @property
@@ -184,58 +470,136 @@ class WheelBuilder(flit_core.wheel.WheelBuilder):
         pure_name = super().wheel_filename
         if not self._extensions:
             return pure_name
-        *parts, _, _, _ = pure_name.split("-")
-        tag = self._platform.tag
-        parts += [tag.interpreter, tag.abi, tag.platform]
-        return "-".join(parts) + ".whl"
+        base = pure_name.rsplit("-", 3)[0]
+        return f"{base}-{self._platform.tag_str}.whl"
 
     def _add_file(self, full_path: str, rel_path: str) -> None:
         # HACK: Do not add extension sources to wheel.
-        if pathlib.Path(full_path).resolve() in self._extension_sources:
+        if _normalize_path(full_path) in self._extension_sources:
             return
         super()._add_file(full_path, rel_path)
 
     def _generate_build_zig(self) -> None:
-        source = importlib.resources.read_text(
-            __package__,
-            "build.zig.jinja2",
-            encoding="utf-8",
-        )
         context = {
             "extensions": self._extensions,
             "includepy": self._platform.includepy,
             "libpy": self._platform.libpy,
             "pythonlib": self._platform.python_lib_name,
         }
-        rendered = jinja2.Template(source).render(context)
+        rendered = _get_build_zig_template().render(context).encode("utf-8")
         path = pathlib.Path("build.zig")
-        if path.exists() and path.read_text(encoding="utf-8") == rendered:
-            return
-        path.write_text(rendered, encoding="utf-8")
+        # Only read the existing file back if it can possibly be the same.
+        # Bytes are written (and compared) so newlines are not translated.
+        try:
+            unchanged = (
+                path.stat().st_size == len(rendered)
+                and path.read_bytes() == rendered
+            )
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            path.write_bytes(rendered)
+
+    def _get_artifact_paths(self) -> typing.List[typing.Tuple[str, str]]:
+        """Pairs of where each artifact is compiled to and copied to."""
+        tag = self._platform.tag
+        ext_suffix = self._platform.ext_suffix
+        lib_name_template = self._platform.zig_lib_name_template
+        return [
+            (
+                ext.get_artifact_path(lib_name_template),
+                os.path.join(
+                    self.module.path, ext.get_target_path(tag, ext_suffix)
+                ),
+            )
+            for ext in self._extensions
+        ]
+
+    def _get_zig_build_key(self) -> str:
+        """Fingerprint of all inputs that can affect Zig's output.
+
+        Besides the Zig and Python versions, build.zig, and declared sources,
+        this covers every non-Python file in the module and source directories
+        below the project root, since sources can include files (e.g. headers)
+        not declared in extensions.
+        """
+        root = _normalize_path(self.directory)
+        candidates = {
+            os.path.dirname(source)
+            for ext in self._extensions
+            for source in ext.sources
+        }
+        if os.path.isdir(self.module.path):
+            candidates.add(_normalize_path(self.module.path))
+        # Artifacts copied into the package are outputs, not inputs.
+        excluded = {
+            _normalize_path(target) for _, target in self._get_artifact_paths()
+        }
+        inputs = {"build.zig": _get_stat_key("build.zig")}
+        for ext in self._extensions:
+            for source in ext.sources:
+                inputs[source] = _get_stat_key(source)
+        for directory in _get_input_directories(candidates, root):
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames[:] = [d for d in dirnames if not _is_skipped_dir(d)]
+                for filename in filenames:
+                    if filename.endswith(".py"):
+                        continue
+                    path = _normalize_path(os.path.join(dirpath, filename))
+                    if path not in excluded:
+                        inputs[path] = _get_stat_key(path)
+        key = {
+            "inputs": sorted(inputs.items()),
+            "python": sys.version,
+            "zig": importlib.metadata.version("ziglang"),
+        }
+        return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+    def _is_zig_build_up_to_date(self, build_key: str) -> bool:
+        """Whether the last Zig build was done with the same inputs.
+
+        Zig does not rewrite an artifact on a cache hit, so the inputs of the
+        last build are recorded in a stamp file instead of relying on artifact
+        mtimes. The build is also redone if any artifact is missing.
+        """
+        try:
+            recorded_key = ZIG_BUILD_STAMP.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return False
+        if recorded_key != build_key:
+            return False
+        return all(
+            os.path.exists(compiled)
+            for compiled, _ in self._get_artifact_paths()
+        )
 
     def _run_zig_build(self) -> None:
-        args = [sys.executable, "-m", "ziglang", "build"]
+        # Use a shared cache so it survives builds in temporary copies.
+        cache_dir = os.path.join(_get_user_cache_dir(), "zig")
+        args = [_get_zig_executable(), "build", "--cache-dir", cache_dir]
         subprocess.run(args, check=True)
 
     def _copy_artifacts(self) -> None:
-        for ext in self._extensions:
-            compiled = pathlib.Path(
-                "zig-out",
-                "lib",
-                ext.directory_in_package,
-                self._platform.zig_lib_name_template.format(name=ext.modname),
-            )
-            target = pathlib.Path(
-                self.module.path,
-                ext.get_target_path(self._platform),
-            )
-            if target.exists() and filecmp.cmp(compiled, target):
-                continue
-            shutil.copy2(compiled, target)
+        artifact_paths = self._get_artifact_paths()
+        if len(artifact_paths) <= 1:
+            for compiled, target in artifact_paths:
+                _copy_artifact(compiled, target)
+            return
+        # Artifacts are independent, and copying them is mostly I/O that does
+        # not hold the GIL. Consume the results so exceptions are raised.
+        workers = min(8, len(artifact_paths))
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            compiled_paths, target_paths = zip(*artifact_paths)
+            list(executor.map(_copy_artifact, compiled_paths, target_paths))
 
     def _compile_binaries(self) -> None:
         self._generate_build_zig()
-        self._run_zig_build()
+        # Computed before building, so changes made during the build are
+        # picked up next time.
+        build_key = self._get_zig_build_key()
+        if not self._is_zig_build_up_to_date(build_key):
+            self._run_zig_build()
+            ZIG_BUILD_STAMP.write_text(build_key, encoding="utf-8")
         self._copy_artifacts()
 
     def copy_module(self) -> None:
@@ -251,7 +615,7 @@ class WheelBuilder(flit_core.wheel.WheelBuilder):
         ignore_wheel: bool = True,
     ) -> typing.Iterator[typing.TextIO]:
         # HACK: Do not write the WHEEL file.
-        if ignore_wheel and relname == f"{self.dist_info}/WHEEL":
+        if ignore_wheel and relname == self._wheel_relname:
             yield io.StringIO()
             return
         with super()._write_to_zip(relname) as f:
@@ -259,12 +623,11 @@ class WheelBuilder(flit_core.wheel.WheelBuilder):
 
     def _write_wheel(self) -> None:
         """Actually wwrite the WHEEL file and its entry in RECORD."""
-        name = f"{self.dist_info}/WHEEL"
         content = WHEEL_TEMPLATE.format(
             version=zlig_version,
-            tag=self._platform.tag,
+            tag=self._platform.tag_str,
         )
-        with self._write_to_zip(name, ignore_wheel=False) as f:
+        with self._write_to_zip(self._wheel_relname, ignore_wheel=False) as f:
             f.write(content)
 
     def write_metadata(self) -> None: